@@ -0,0 +1,52 @@
+# BATCH_LOG_PATH에 쌓인 요청을 Batch API로 올리는 스크립트 (야간 cron용, 라이브 서버와 별개)
+# 사용: python batch_eval.py [/tmp/pending_batch.jsonl]
+import os
+import sys
+import glob
+import time
+from openai import OpenAI
+
+def pending_files(path: str) -> list[str]:
+    # 이전 실행에서 업로드 실패로 남은 path.<ts> 파일도 같이 (오래된 것부터)
+    found = [p for p in glob.glob(glob.escape(path) + ".*") if p.rsplit(".", 1)[1].isdigit()]
+    return sorted(found, key=lambda p: int(p.rsplit(".", 1)[1]))
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("BATCH_LOG_PATH", "/tmp/pending_batch.jsonl")
+    # 서버가 계속 쓰는 중일 수 있으니 먼저 이름을 바꿔서 떼어낸 뒤 업로드
+    # (바로 다시 돌려도 남아 있던 파일을 덮어쓰지 않게 ns 단위 이름)
+    if os.path.exists(path) and os.path.getsize(path) > 0:
+        os.replace(path, f"{path}.{time.time_ns()}")
+
+    pending = pending_files(path)
+    if not pending:
+        print(f"[Batch] Nothing to upload: {path}")
+        return
+
+    client = OpenAI(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+    )
+    failed = 0
+    for name in pending:
+        try:
+            with open(name, "rb") as f:
+                batch_file = client.files.create(file=f, purpose="batch")
+            batch = client.batches.create(
+                input_file_id=batch_file.id,
+                endpoint="/v1/chat/completions",
+                completion_window="24h",
+            )
+        except Exception as e:
+            # 파일은 그대로 두고 다음 실행에서 다시 시도
+            print(f"[Batch] Upload failed, kept {name}: {e}", file=sys.stderr)
+            failed += 1
+            continue
+        # 배치가 만들어진 뒤에만 지움
+        os.remove(name)
+        print(f"[Batch] Created {batch.id} from {name}")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
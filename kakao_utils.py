@@ -0,0 +1,85 @@
+# 카카오 응답 포맷 + 답변 후처리 헬퍼 (정규식/오토마톤은 여기서 한 번만 컴파일)
+import re
+import orjson
+from fastapi import Response
+
+# 응답 봉투는 고정이라 바이트로 미리 만들어 두고 text 자리만 이스케이프해서 끼워 넣음
+_TEXT_HEAD = b'{"version":"2.0","template":{"outputs":[{"simpleText":{"text":'
+_TEXT_TAIL = b'}}]}}'
+
+def kakao_text_bytes(msg: str) -> bytes:
+    return _TEXT_HEAD + orjson.dumps(msg) + _TEXT_TAIL
+
+def kakao_response(msg: str) -> Response:
+    return Response(content=kakao_text_bytes(msg), media_type="application/json")
+
+# 콜백 대기 응답("잠만.")은 항상 같으므로 통째로 미리 직렬화
+CALLBACK_WAIT_BODY = orjson.dumps({
+    "version": "2.0",
+    "useCallback": True,
+    "template": {"outputs": [{"simpleText": {"text": "잠만."}}]},
+})
+
+# 이모티콘 범위는 구간 3개라 정규식 없이 코드포인트 비교로 판별
+# strip_emojis / finalize / is_emoji_only가 모두 이 판별 하나만 씀
+_EMOJI_RANGES = ((0x2700, 0x27BF), (0x1F1E6, 0x1F1FF), (0x1F300, 0x1FAFF))
+
+def _is_emoji(ch: str) -> bool:
+    o = ord(ch)
+    return any(lo <= o <= hi for lo, hi in _EMOJI_RANGES)
+
+def strip_emojis(text: str) -> str:
+    if not text:
+        return text
+    # 프롬프트에서 이모티콘 금지라 대부분 없음 -> 첫 이모티콘 위치까지는 복사 없이 훑기만 함
+    for i, ch in enumerate(text):
+        if _is_emoji(ch):
+            break
+    else:
+        return text
+    out = [text[:i]]
+    for ch in text[i + 1:]:
+        if not _is_emoji(ch):
+            out.append(ch)
+    return "".join(out)
+
+# "❤️"(U+2764 U+FE0F), "👨‍👩‍👧"(ZWJ 결합)처럼 이모티콘 뒤에 붙는 변형 선택자/ZWJ는 범위 밖이라 따로 지움
+_EMOJI_JOINERS = dict.fromkeys(map(ord, "\ufe0e\ufe0f\u200d"))
+
+def is_emoji_only(text: str) -> bool:
+    # 이모티콘/공백만 있는 메시지인지 (빈 문자열 포함)
+    return not strip_emojis(text).translate(_EMOJI_JOINERS).strip()
+
+# str.splitlines()가 줄바꿈으로 보는 문자 전부 (\r\n은 \r, \n 두 번으로 끊기지만 가운데 빈 줄은 버려짐)
+LINE_BREAKS = frozenset("\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029")
+
+def finalize(text: str, max_lines: int = 3) -> str:
+    # 이모티콘 제거 + 줄 정리를 한 번에: 문자열을 한 번만 훑으면서 이모티콘은 건너뛰고,
+    # 비어있지 않은 줄 max_lines개 모이면 바로 멈춤 (중간 문자열/리스트 안 만듦)
+    out: list[str] = []
+    line: list[str] = []
+    for ch in text or "":
+        if ch in LINE_BREAKS:
+            s = "".join(line).strip()
+            if s:
+                out.append(s)
+                if len(out) == max_lines:
+                    break
+            line.clear()
+            continue
+        if _is_emoji(ch):
+            continue
+        line.append(ch)
+    else:
+        s = "".join(line).strip()
+        if s:
+            out.append(s)
+    return "\n".join(out)
+
+_POLITE_MARKERS = ("요", "니다", "까요", "드립니다", "했어요", "되나요", "주세요", "죄송", "감사")
+# 마커 9개를 매번 하나씩 찾지 않고 정규식 한 번으로 스캔
+_POLITE_RE = re.compile("|".join(map(re.escape, _POLITE_MARKERS)))
+
+def detect_politeness(user_text: str) -> str:
+    # 공백은 매칭에 영향 없으니 strip 복사 없이 바로 검색
+    return "polite" if user_text and _POLITE_RE.search(user_text) else "casual"
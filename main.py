@@ -1,159 +1,437 @@
 import os
-import re
+import time
+import uuid
+import queue
 import asyncio
+import logging
+import importlib
+import logging.handlers
+from contextlib import asynccontextmanager
 import httpx
-from fastapi import FastAPI, Request, BackgroundTasks
-from fastapi.responses import JSONResponse
-from openai import AsyncOpenAI
+import numpy as np
+import orjson
+from cachetools import TTLCache
+from fastapi import FastAPI, Request, Response
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from kakao_utils import kakao_text_bytes, kakao_response, CALLBACK_WAIT_BODY, finalize, strip_emojis, is_emoji_only, detect_politeness, LINE_BREAKS
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 카카오 콜백용 httpx 클라이언트는 앱 시작 시 한 번 만들고 keep-alive 커넥션 재사용
+    app.state.http = httpx.AsyncClient(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        timeout=10.0,
+    )
+    try:
+        yield
+    finally:
+        # create_task로 띄운 콜백은 uvicorn이 모르니, 클라이언트 닫기 전에 직접 기다려 줌 (배포 재시작 시 답변 유실 방지)
+        if _BACKGROUND_TASKS:
+            _, pending = await asyncio.wait(set(_BACKGROUND_TASKS), timeout=SHUTDOWN_GRACE)
+            if pending:
+                logger.warning("[Shutdown] %d callbacks still running, cancelling", len(pending))
+                for task in pending:
+                    task.cancel()
+                await asyncio.wait(pending)
+        await app.state.http.aclose()
+        # 모듈 단위 Gemini 클라이언트도 종료 시 커넥션 풀 정리
+        await client.close()
+        # 큐에 남은 로그까지 다 쓰고 리스너 스레드 종료 (위 정리 중 찍힌 로그도 나가도록 맨 마지막에)
+        # QueueListener.stop()은 두 번 부르면 터지므로 목록에서 빼면서 한 번씩만
+        while _LOG_LISTENERS:
+            _LOG_LISTENERS.pop().stop()
 
-# --- 1. 유틸리티 ---
-def kakao_text(msg: str) -> dict:
-    return {
-        "version": "2.0",
-        "template": {"outputs": [{"simpleText": {"text": msg}}]},
-    }
+app = FastAPI(lifespan=lifespan)
+
+# 로그는 큐에 넣기만 하고 실제 출력은 별도 스레드에서 (이벤트 루프에서 write() 안 함)
+# 요청마다 찍던 디버그 로그는 기본 INFO 레벨에서 포매팅 자체를 건너뜀
+logger = logging.getLogger("lover-bot")
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+logger.propagate = False
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+_log_listener = logging.handlers.QueueListener(_log_queue, _log_stream)
+_log_listener.start()
+# 종료 시 멈출 리스너 목록 (lifespan에서 비움)
+_LOG_LISTENERS: list[logging.handlers.QueueListener] = [_log_listener]
 
-_EMOJI_RE = re.compile(r"[\U0001F300-\U0001FAFF\U00002700-\U000027BF\U0001F1E6-\U0001F1FF]+", flags=re.UNICODE)
+# 평가/리플레이용으로 실제 요청을 Batch API 입력(JSONL) 형식으로 쌓아 둠 (BATCH_LOG_PATH 지정 시에만)
+# 업로드는 batch_eval.py로 따로 (라이브 경로와 무관)
+BATCH_LOG_PATH = os.environ.get("BATCH_LOG_PATH")
+_batch_logger = logging.getLogger("lover-bot.batch")
+_batch_logger.setLevel(logging.INFO)
+_batch_logger.propagate = False
+if BATCH_LOG_PATH:
+    _batch_queue: queue.SimpleQueue = queue.SimpleQueue()
+    _batch_logger.addHandler(logging.handlers.QueueHandler(_batch_queue))
+    # batch_eval.py가 파일을 옮겨가면 새 파일로 다시 열도록 WatchedFileHandler 사용
+    _batch_file = logging.handlers.WatchedFileHandler(BATCH_LOG_PATH, encoding="utf-8")
+    _batch_file.setFormatter(logging.Formatter("%(message)s"))
+    _batch_listener = logging.handlers.QueueListener(_batch_queue, _batch_file)
+    _batch_listener.start()
+    _LOG_LISTENERS.append(_batch_listener)
 
-def strip_emojis(text: str) -> str:
-    return _EMOJI_RE.sub("", text)
+# Gemini 클라이언트는 모듈 로드 시 한 번만 생성 (요청마다 만들면 매번 TLS 핸드셰이크 + 소켓 누수)
+# HTTP/2로 동시 요청이 한 커넥션에 다중화되어 몰릴 때도 핸드셰이크/헤더 비용 공유
+client = AsyncOpenAI(
+    api_key=os.environ.get("OPENAI_API_KEY"),
+    base_url="https://generativelanguage.googleapis.com/v1beta/openai/",
+    # 429/5xx/연결 오류는 SDK가 Retry-After 헤더 보고 지수 백오프(+지터)로 재시도
+    max_retries=int(os.environ.get("OPENAI_MAX_RETRIES", "2")),
+    # SDK 기본값(10분) 대신 요청당 15초 상한. 느린 호출이 이벤트 루프 작업/커넥션을 오래 붙잡지 않게
+    timeout=float(os.environ.get("OPENAI_TIMEOUT", "15.0")),
+    http_client=DefaultAsyncHttpxClient(
+        http2=True,
+        limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+    ),
+)
 
-def collapse_lines(text: str, max_lines: int = 3) -> str:
-    lines = [ln.strip() for ln in (text or "").splitlines() if ln.strip()]
-    return "\n".join(lines[:max_lines]).strip()
+# 같은 말투 + 같은 문장이면 Gemini 다시 안 부르고 이전 답변 재사용 ("ㅇㅇ", "뭐하냐" 같은 반복 입력)
+# 이벤트 루프 단일 스레드에서만 접근하므로 락 불필요
+_ANSWER_CACHE: TTLCache = TTLCache(maxsize=4096, ttl=3600)
+# 긴 문장은 거의 반복되지 않으니 캐시에 안 넣음 (캐시가 일회성 답변으로 차는 것 방지)
+_CACHEABLE_LEN = 128
+
+OPENAI_SEM = asyncio.Semaphore(int(os.environ.get("OPENAI_CONCURRENCY", "8")))
+
+# --- 1. 유틸리티 ---
+def cache_key(user_text: str) -> tuple[str, str]:
+    # 대소문자/공백 차이("뭐 하냐" vs "뭐  하냐")는 같은 입력으로 취급
+    return (detect_politeness(user_text), " ".join(user_text.casefold().split()))
 
-def detect_politeness(user_text: str) -> str:
-    t = (user_text or "").strip()
-    polite_markers = ["요", "니다", "까요", "드립니다", "했어요", "되나요", "주세요", "죄송", "감사"]
-    if any(m in t for m in polite_markers): return "polite"
-    return "casual"
+def remember_answer(key: tuple[str, str], answer: str):
+    if len(key[1]) <= _CACHEABLE_LEN:
+        _ANSWER_CACHE[key] = answer
 
 # --- 2. 페르소나 설정 ---
-FRIEND_SYSTEM = """
-너는 사용자의 '친구 전용' 챗봇이다. 따뜻하거나 친절한 톤 금지. 툭툭 던지는 친구 말투로.
-
-규칙:
-- 이모티콘/느낌표/감탄사 금지
-- 한 답변 1~3줄. 길게 설명 금지
-- 기본 반말. 사용자가 존댓말이면 너도 존댓말(딱딱하게)로만 맞춰
-- 공감은 선택. 꼭 해야 할 때만 한 단어로: "ㅇㅇ", "그럴만함", "알겠음"
-- 질문은 최대 1개. 캐묻지 마
-- 리액션 짧게: "ㅇㅇ", "ㅇㅋ", "왜", "와이", "?", "ㄱㄱ", "ㄴㄴ", "ㅋㅋ"
-- 해결은 A/B 한줄 정리 또는 다음 액션 한줄만 제시
-""".strip()
-
-FRIEND_PROFILE = """
-[내 프로필(친구용)]
-- 생일: 1999/06/08
-- 소속: 한양대 대학원(석박통합) / (UNICON 랩)
-- 말투: 이모티콘 안씀, 짧게 말함, 현실적으로 정리함
-""".strip()
-
-FRIEND_FEWSHOT = [
-    {"role": "user", "content": "뭐하냐"},
-    {"role": "assistant", "content": "그냥 있음. 와이"},
-    {"role": "user", "content": "나 요즘 너무 바빠서 뭐부터 해야할지 모르겠음"},
-    {"role": "assistant", "content": "급한거부터. 마감 뭐임"},
-]
+# PERSONA 환경변수로 personas/<이름>.py 선택 (SYSTEM / PROFILE / FEWSHOT / TRIVIAL_REPLIES)
+PERSONA = os.environ.get("PERSONA", "friend")
+persona = importlib.import_module(f"personas.{PERSONA}")
+
+# 모델/생성 설정도 환경변수로 (기본값은 지금까지 쓰던 값)
+MODEL = os.environ.get("MODEL", "gemini-1.5-flash")
+MAX_TOKENS = int(os.environ.get("MAX_TOKENS", "48"))
+SYNC_TIMEOUT = float(os.environ.get("SYNC_TIMEOUT", "3.5"))
+SYNC_DEADLINE = float(os.environ.get("SYNC_DEADLINE", "3.0"))
+# 카카오는 콜백을 1분 정도만 기다림. 그 안에 못 만들면 짧은 대체 멘트라도 보냄
+CALLBACK_BUDGET = float(os.environ.get("CALLBACK_BUDGET", "50.0"))
+# 종료 시 진행 중인 콜백을 기다리는 최대 시간 (Render는 SIGTERM 후 30초 뒤 강제 종료)
+SHUTDOWN_GRACE = float(os.environ.get("SHUTDOWN_GRACE", "25.0"))
+
+# 1~3줄 답변이면 48토큰으로 충분. 빈 줄/설명 붙이기 시작하면 서버에서 바로 끊음
+GEN_OPTIONS = {
+    "max_tokens": MAX_TOKENS,
+    "stop": ["\n\n", "설명:", "요약:"],
+    "temperature": 0.6,
+}
+
+STYLE_ADDON = {
+    "polite": "사용자가 존댓말이면 너도 존댓말로.",
+    "casual": "사용자가 반말이면 너도 반말로.",
+}
+
+def render_examples(fewshot) -> str:
+    # fewshot 대화를 메시지로 따로 보내지 않고 system 프롬프트 안에 예시 텍스트로 넣음 (입력 토큰 절약)
+    lines = ["예시:"]
+    for msg in fewshot:
+        prefix = "사용자: " if msg["role"] == "user" else "답: "
+        lines.append(prefix + msg["content"])
+    return "\n".join(lines)
+
+# system 프롬프트는 모든 요청에서 바이트 단위로 같게 유지 (서버 측 프롬프트 캐시 재사용)
+# 말투 힌트는 뒤쪽 별도 메시지로 빼서 앞부분을 건드리지 않음
+_SYSTEM_PROMPT = f"{persona.SYSTEM}\n\n{persona.PROFILE}\n\n{render_examples(persona.FEWSHOT)}"
+_BASE_MSGS = {
+    mode: (
+        {"role": "system", "content": _SYSTEM_PROMPT},
+        {"role": "system", "content": addon},
+    )
+    for mode, addon in STYLE_ADDON.items()
+}
 
 def build_messages(user_text: str) -> list[dict]:
     mode = detect_politeness(user_text)
-    style_addon = "사용자가 존댓말이면 너도 존댓말로." if mode == "polite" else "사용자가 반말이면 너도 반말로."
-    
-    return [
-        {"role": "system", "content": f"{FRIEND_SYSTEM}\n{style_addon}\n\n{FRIEND_PROFILE}"},
-        *FRIEND_FEWSHOT,
-        {"role": "user", "content": user_text},
-    ]
-
-# --- 3. 백그라운드 작업 (핵심: 콜백 보내기) ---
-async def background_process(callback_url: str, user_text: str):
-    # ★ 핵심 수정: Gemini 주소와 모델명 사용
-    client = AsyncOpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY"),
-        base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-    )
-    
+    return [*_BASE_MSGS[mode], {"role": "user", "content": user_text}]
+
+# --- 3. 답변 생성 (캐시 -> Gemini) ---
+# "뭐함" / "뭐하냐" / "뭐하는중"처럼 비슷한 말은 임베딩 유사도로 같은 답변 재사용
+EMBED_MODEL = os.environ.get("EMBED_MODEL", "gemini-embedding-001")
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE", "1") == "1"
+# 임베딩 조회하는 동안 Gemini 호출도 미리 같이 시작 (캐시 히트면 취소)
+SPECULATIVE_CHAT = os.environ.get("SPECULATIVE_CHAT", "1") == "1"
+
+class SemanticCache:
+    def __init__(self, maxsize: int = 512, ttl: float = 600.0, threshold: float = 0.92):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        # (maxsize, dim) 링 버퍼에 제자리로 씀 (add마다 vstack으로 전체 복사하지 않게). dim은 첫 add 때 정해짐
+        self._vecs: np.ndarray | None = None  # 정규화된 벡터
+        self._answers: list[str | None] = [None] * maxsize
+        self._stamps = np.full(maxsize, -np.inf)
+        self._size = 0  # 채워진 칸 수
+        self._next = 0  # 다음에 쓸 칸 (가득 차면 가장 오래된 칸을 덮어씀)
+
+    def lookup(self, vec: np.ndarray) -> str | None:
+        if not self._size:
+            return None
+        sims = self._vecs[:self._size] @ vec
+        # 만료된 칸은 지우지 않고 후보에서만 뺌 (나중에 덮어씀)
+        sims[time.monotonic() - self._stamps[:self._size] > self.ttl] = -np.inf
+        best = int(sims.argmax())
+        return self._answers[best] if sims[best] >= self.threshold else None
+
+    def add(self, vec: np.ndarray, answer: str):
+        if self._vecs is None:
+            self._vecs = np.zeros((self.maxsize, vec.shape[0]), dtype=np.float32)
+        i = self._next
+        self._vecs[i] = vec
+        self._answers[i] = answer
+        self._stamps[i] = time.monotonic()
+        self._next = (i + 1) % self.maxsize
+        self._size = min(self._size + 1, self.maxsize)
+
+# 말투가 다르면 답변도 달라야 하므로 모드별로 따로 둠
+_SEMANTIC_CACHE = {"polite": SemanticCache(), "casual": SemanticCache()}
+
+async def embed(text: str) -> np.ndarray | None:
     try:
-        # OpenAI 호출 (이제 시간 제한 걱정 없음)
-        res = await client.chat.completions.create(
-            model="gemini-1.5-flash",  # ★ 여기를 꼭 구글 모델로 바꿔야 함
+        res = await client.embeddings.create(model=EMBED_MODEL, input=text)
+    except Exception as e:
+        # 임베딩 실패해도 답변은 나가야 하니 캐시만 건너뜀
+        logger.warning("[Embed Error] %s", e)
+        return None
+    vec = np.asarray(res.data[0].embedding, dtype=np.float32)
+    return vec / (np.linalg.norm(vec) or 1.0)
+
+def log_for_batch(user_text: str):
+    if not BATCH_LOG_PATH:
+        return
+    _batch_logger.info(orjson.dumps({
+        "custom_id": uuid.uuid4().hex,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {"model": MODEL, "messages": build_messages(user_text), **GEN_OPTIONS},
+    }).decode())
+
+async def complete(user_text: str, deadline: float | None = None) -> tuple[str, bool]:
+    # 스트리밍으로 받다가 3줄 채워지거나 deadline(초) 넘으면 나머지는 안 기다리고 끊음
+    # 반환: (답변, deadline 때문에 중간에 잘렸는지)
+    started = time.monotonic()
+    cut_short = False
+    # 동시에 나가는 Gemini 호출 수 제한 (몰릴 때 429 / 꼬리 지연 방지)
+    async with OPENAI_SEM:
+        stream = await client.chat.completions.create(
+            model=MODEL,  # ★ Gemini 모델명이어야 함
             messages=build_messages(user_text),
-            max_tokens=80,
-            temperature=0.6,
+            **GEN_OPTIONS,
+            stream=True,
+            stream_options={"include_usage": True},
         )
-        answer = res.choices[0].message.content.strip()
-        answer = strip_emojis(answer)
-        answer = collapse_lines(answer, max_lines=3)
+        parts: list[str] = []
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    logger.debug("[Usage] prompt=%s completion=%s", chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                parts.append(delta)
+                if not LINE_BREAKS.isdisjoint(delta):
+                    text = "".join(parts)
+                    done_lines = text.splitlines()
+                    # 줄바꿈으로 안 끝났으면 마지막 줄은 아직 받는 중
+                    if text[-1] not in LINE_BREAKS:
+                        done_lines.pop()
+                    # 이모티콘만 있는 줄은 후처리에서 사라지니 줄 수에 안 셈
+                    if sum(1 for ln in done_lines if strip_emojis(ln).strip()) >= 3:
+                        break
+                if deadline is not None and parts and time.monotonic() - started > deadline:
+                    cut_short = True
+                    break
+        finally:
+            await stream.close()
+    log_for_batch(user_text)
+    return finalize("".join(parts)), cut_short
+
+async def _generate(user_text: str, deadline: float | None = None) -> str:
+    key = cache_key(user_text)
+    mode = key[0]
+    if not SEMANTIC_CACHE_ENABLED:
+        answer, cut_short = await complete(user_text, deadline)
+        # 잘린 답변/빈 답변은 캐시에 넣지 않음 (다음 요청들에 계속 잘린 답이 나가지 않게)
+        if answer and not cut_short:
+            remember_answer(key, answer)
+        return answer
+
+    chat_task = asyncio.create_task(complete(user_text, deadline)) if SPECULATIVE_CHAT else None
+    try:
+        vec = await embed(user_text)
+        hit = _SEMANTIC_CACHE[mode].lookup(vec) if vec is not None else None
+        if hit is not None:
+            if chat_task is not None:
+                chat_task.cancel()
+            logger.debug("[Semantic Hit] %s", user_text)
+            remember_answer(key, hit)
+            return hit
+        answer, cut_short = await (chat_task if chat_task is not None else complete(user_text, deadline))
+    except BaseException:
+        # 타임아웃/취소로 빠져나갈 때 미리 띄운 Gemini 호출이 남지 않게 정리
+        if chat_task is not None:
+            chat_task.cancel()
+        raise
+
+    if answer and not cut_short:
+        remember_answer(key, answer)
+        # 긴 일회성 문장은 의미 캐시에도 안 넣음 (remember_answer와 같은 기준)
+        if vec is not None and len(key[1]) <= _CACHEABLE_LEN:
+            _SEMANTIC_CACHE[mode].add(vec, answer)
+    return answer
+
+# 카카오 재시도 등으로 같은 말이 동시에 들어오면 Gemini 호출 하나를 같이 기다림 (single-flight)
+# 값은 [작업, 기다리는 요청 수]. 마지막으로 기다리던 요청이 포기할 때만 작업을 취소
+# deadline도 키에 넣음: 콜백(deadline 없음)과 직접 응답(SYNC_DEADLINE)이 서로의 마감으로 잘리지 않게
+_INFLIGHT: dict[tuple[tuple[str, str], float | None], list] = {}
+
+async def generate_answer(user_text: str, deadline: float | None = None) -> str:
+    key = (cache_key(user_text), deadline)
+    entry = _INFLIGHT.get(key)
+    if entry is None:
+        entry = [asyncio.create_task(_generate(user_text, deadline)), 0]
+        _INFLIGHT[key] = entry
+
+        def _done(t: asyncio.Task, key=key, entry=entry):
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+        entry[0].add_done_callback(_done)
+    else:
+        logger.debug("[Coalesced] %s", user_text)
+
+    task = entry[0]
+    entry[1] += 1
+    try:
+        # 한 요청이 타임아웃/취소돼도 같이 기다리는 요청이 있으면 작업은 계속 돌게 shield
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        if entry[1] == 0 and not task.done():
+            # 아무도 안 기다리면 Gemini 스트림 취소. 취소 중인 작업에 새 요청이 붙지 않게 바로 뺌
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+            task.cancel()
+
+# --- 4. 백그라운드 작업 (핵심: 콜백 보내기) ---
+# create_task로 띄운 작업은 참조가 없으면 GC될 수 있어서 끝날 때까지 여기 보관
+_BACKGROUND_TASKS: set[asyncio.Task] = set()
+
+_JSON_HEADERS = {"content-type": "application/json"}
+
+async def background_process(callback_url: str, user_text: str):
+    try:
+        # 콜백이 버려지기 전에 끝나도록 전체 생성에 상한. 넘기면 대체 멘트
+        # (같은 말을 기다리는 다른 요청이 없으면 generate_answer가 Gemini 스트림도 취소)
+        try:
+            answer = await asyncio.wait_for(generate_answer(user_text), timeout=CALLBACK_BUDGET)
+        except asyncio.TimeoutError:
+            logger.warning("[Callback Timeout] %s", user_text)
+            answer = "좀만"
 
         # ★ 카카오 서버로 답변 전송 (POST)
-        async with httpx.AsyncClient() as http_client:
-            await http_client.post(
-                callback_url,
-                json=kakao_text(answer),
-                timeout=10.0
-            )
-            print(f"[Callback Success] Sent: {answer}")
+        # httpx 내부 json.dumps 대신 orjson으로 만든 바이트를 그대로 전송
+        await app.state.http.post(
+            callback_url,
+            content=kakao_text_bytes(answer),
+            headers=_JSON_HEADERS,
+            timeout=5.0,
+        )
+        logger.debug("[Callback Success] Sent: %s", answer)
 
     except Exception as e:
-        print(f"[Callback Error] {e}")
+        logger.error("[Callback Error] %s", e)
 
-# --- 4. 메인 엔드포인트 ---
+# --- 5. 메인 엔드포인트 ---
+# 헬스체크 (Render 등에서 살아있는지 확인용)
+@app.get("/")
+async def health():
+    return {"status": "ok"}
+
+# userRequest 없을 때 매 요청 빈 dict 새로 만들지 않도록 공유 (읽기 전용)
+_EMPTY: dict = {}
+
+# 슬래시 있는/없는 경로 모두 같은 핸들러에 직접 연결 (redirect_slashes는 POST에 307을 돌려주므로 안 씀)
 @app.post("/kakao/lover")
-async def kakao_friend(req: Request, background_tasks: BackgroundTasks):
+@app.post("/kakao/lover/")
+async def kakao_friend(req: Request):
     try:
-        data = await req.json()
-        user_request = data.get("userRequest", {})
-        user_text = user_request.get("utterance", "").strip()
-        callback_url = user_request.get("callbackUrl")
+        # Starlette 기본 json.loads 대신 orjson으로 파싱
+        data = orjson.loads(await req.body())
+        # userRequest는 한 번만 꺼내고, utterance가 null로 와도 빈 문자열로 처리
+        ur = data.get("userRequest") or _EMPTY
+        user_text = (ur.get("utterance") or "").strip()
+        callback_url = ur.get("callbackUrl")
 
         if not user_text:
-            return JSONResponse(kakao_text("?"))
+            return kakao_response("?")
+
+        # 0. 리액션/한 글자/이모티콘만 있는 입력은 바로 고정 답변
+        trivial = persona.TRIVIAL_REPLIES.get(user_text)
+        if trivial is not None:
+            return kakao_response(trivial)
+        if len(user_text) < 2 or is_emoji_only(user_text):
+            return kakao_response("?")
+
+        # 캐시에 있으면 콜백/Gemini 없이 바로 답변
+        cached = _ANSWER_CACHE.get(cache_key(user_text))
+        if cached is not None:
+            logger.debug("[Cache Hit] %s", user_text)
+            return kakao_response(cached)
 
         # 1. 콜백 URL이 있으면 -> "잠만." 먼저 뱉고 뒤에서 처리
         if callback_url:
-            print(f"[Async] Background Task Started for: {user_text}")
-            background_tasks.add_task(background_process, callback_url, user_text)
+            logger.debug("[Async] Background Task Started for: %s", user_text)
+            # BackgroundTasks는 응답 전송이 끝난 뒤에 시작하므로, 응답 보내는 동안 Gemini 호출이 먼저 출발하도록 바로 띄움
+            task = asyncio.create_task(background_process(callback_url, user_text))
+            _BACKGROUND_TASKS.add(task)
+            task.add_done_callback(_BACKGROUND_TASKS.discard)
             
             # ★ 카카오에게: "잠만." (대기 멘트 추가함)
-            return JSONResponse({
-                "version": "2.0",
-                "useCallback": True,
-                "template": {
-                    "outputs": [
-                        {
-                            "simpleText": {
-                                "text": "잠만."
-                            }
-                        }
-                    ]
-                }
-            })
+            return Response(content=CALLBACK_WAIT_BODY, media_type="application/json")
 
         # 2. 테스트용 (콜백 URL 없을 때도 Gemini 사용)
         else:
-            print("[Sync] No Callback URL. Processing directly.")
-            # 여기도 Gemini 설정으로 통일
-            client = AsyncOpenAI(
-                api_key=os.environ.get("OPENAI_API_KEY"),
-                base_url="https://generativelanguage.googleapis.com/v1beta/openai/"
-            )
-            res = await client.chat.completions.create(
-                model="gemini-1.5-flash", # 모델명 통일
-                messages=build_messages(user_text),
-                max_tokens=80,
-                temperature=0.6,
-                timeout=10.0 
+            logger.debug("[Sync] No Callback URL. Processing directly.")
+            # 카카오 5초 제한 안에 끝나도록 3초 넘으면 받은 데까지만 쓰고, 3.5초에서는 완전히 끊음
+            answer = await asyncio.wait_for(
+                generate_answer(user_text, deadline=SYNC_DEADLINE), timeout=SYNC_TIMEOUT
             )
-            answer = strip_emojis(res.choices[0].message.content.strip())
-            return JSONResponse(kakao_text(answer))
+            return kakao_response(answer)
 
+    except orjson.JSONDecodeError as e:
+        logger.warning("[Error] Bad request body: %s", e)
+        return kakao_response("오류.")
+    except asyncio.TimeoutError:
+        logger.warning("[Error] Sync OpenAI call timed out")
+        return kakao_response("오류.")
     except Exception as e:
-        print(f"[Error] {e}")
-        return JSONResponse(kakao_text("오류."))
+        logger.error("[Error] %s", e)
+        return kakao_response("오류.")
 
-@app.post("/kakao/lover/")
-async def kakao_friend_slash(req: Request, background_tasks: BackgroundTasks):
-    return await kakao_friend(req, background_tasks)
+# 로컬 실행: python main.py (render.yaml과 같은 uvloop + httptools 설정)
+# 캐시/커넥션 풀이 프로세스 단위라 워커는 기본 1개, 늘리려면 WEB_CONCURRENCY
+# 워커 1개면 app 객체를 그대로 넘김 ("main:app"으로 넘기면 이 파일이 main으로 한 번 더 import돼서
+# 로거 핸들러가 두 번 붙고 로그/배치 레코드가 두 번씩 찍힘). 여러 개면 워커 프로세스가 각자 import
+if __name__ == "__main__":
+    import uvicorn
+
+    workers = int(os.environ.get("WEB_CONCURRENCY", "1"))
+    uvicorn.run(
+        app if workers == 1 else "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8000")),
+        loop="uvloop",
+        http="httptools",
+        workers=workers,
+    )
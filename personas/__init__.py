@@ -0,0 +1 @@
+# 페르소나 모듈 모음. 각 모듈은 SYSTEM / PROFILE / FEWSHOT / TRIVIAL_REPLIES 를 정의